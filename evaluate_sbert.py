@@ -61,7 +61,7 @@ if __name__ == "__main__":
         sys.path.append(path.dirname( path.dirname( path.abspath(__file__) ) ))
         
         from src.dataloader import VideoDataset
-        from src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder
+        from src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder, set_backend_flags
         from src.utils.sampler import ImbalancedDatasetSampler
         from src.models.transformer import SBERT
         from src.train import train
@@ -70,13 +70,16 @@ if __name__ == "__main__":
     
     else:
         from .src.dataloader import VideoDataset
-        from .src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder
+        from .src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder, set_backend_flags
         from .src.utils.sampler import ImbalancedDatasetSampler
         from .src.models.transformer import SBERT
         from .src.train import train
         from .src.evaluate import evaluate
         from .src.loss import FocalLoss
 
+    # backend setup for the compiled classifier forward
+    set_backend_flags()
+
     test_data_dist = VideoDataset(dataset = dataset, split = "test", clip_len = clip_len, preprocess = False)
     
     if use_sampler:
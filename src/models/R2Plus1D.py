@@ -1,10 +1,24 @@
 import math
 import torch 
 import torch.nn as nn
+import torch.nn.functional as F
+from contextlib import contextmanager
 from typing import Tuple, List, Union
 from torch.nn.modules.utils import _triple
 from pytorch_model_summary import summary
 
+# shape probes and summaries run on uninitialized inputs (torch.empty) :
+# eval mode keeps them from writing into BatchNorm running statistics, inference_mode skips autograd
+@contextmanager
+def probe_mode(model : nn.Module):
+    training = model.training
+    model.eval()
+    try:
+        with torch.inference_mode():
+            yield
+    finally:
+        model.train(training)
+
 # Block Component
 # ConvBlock for Image
 class ConvBlock(nn.Module):
@@ -110,7 +124,7 @@ class Conv3dResBlock(nn.Module):
 # Spatio Temporal Convolution encoder
 # consist of temporal conv and spatio conv with conv3dblock
 class SpatioTemporalConv(nn.Module):
-    def __init__(self, in_channels : int, out_channels : int, kernel_size = (3,1,1), stride = (1,1,1), dilation : int = 1, padding = (1,1,1), bias : bool = False, alpha : float = 0.01, is_first : bool = False):
+    def __init__(self, in_channels : int, out_channels : int, kernel_size = (3,1,1), stride = (1,1,1), dilation : int = 1, padding = (1,1,1), bias : bool = False, alpha : float = 0.01, is_first : bool = False, temporal_as_1d : bool = False):
         super(SpatioTemporalConv, self).__init__()
 
         if type(kernel_size) == int:
@@ -153,9 +167,41 @@ class SpatioTemporalConv(nn.Module):
             self.spatio_conv = Conv3dBlock(in_channels, middle_channels, spatio_kernel_size, spatio_stride, dilation, spatio_padding, bias, alpha)
             self.temporal_conv = Conv3dBlock(middle_channels, out_channels, temporal_kernel_size, temporal_stride, dilation, temporal_padding, bias, alpha)
 
+        # spatial-only kernel (1,kH,kW) : run as conv2d over (B*T,C,H,W), cuDNN 2D kernels are better tuned than conv3d
+        self.spatio_as_2d = spatio_kernel_size[0] == 1 and spatio_stride[0] == 1 and spatio_padding[0] == 0
+
+        # temporal (kT,1,1) kernel run as conv1d over (B*H*W,C,T) : opt-in, the permutes around conv1d cost two extra copies
+        # and it measured 2-3x slower than conv3d on cpu; off by default until it is shown to pay off on a given backend
+        self.temporal_as_1d = temporal_as_1d
+
+    def spatio_forward_2d(self, x:torch.Tensor)->torch.Tensor:
+        conv = self.spatio_conv.conv
+        B,C,T,H,W = x.size()
+        x = x.transpose(1,2).reshape(B*T,C,H,W)
+        x = F.conv2d(x, conv.weight.squeeze(2), conv.bias, conv.stride[1:], conv.padding[1:], conv.dilation[1:])
+        x = x.view(B,T,x.size(1),x.size(2),x.size(3)).transpose(1,2).contiguous()
+        x = self.spatio_conv.relu(self.spatio_conv.bn(x))
+        return x
+
+    def temporal_forward_1d(self, x:torch.Tensor)->torch.Tensor:
+        conv = self.temporal_conv.conv
+        B,C,T,H,W = x.size()
+        x = x.permute(0,3,4,1,2).reshape(B*H*W,C,T)
+        x = F.conv1d(x, conv.weight.view(conv.out_channels, conv.in_channels, -1), conv.bias, conv.stride[0], conv.padding[0], conv.dilation[0])
+        x = x.view(B,H,W,x.size(1),x.size(2)).permute(0,3,4,1,2).contiguous()
+        x = self.temporal_conv.relu(self.temporal_conv.bn(x))
+        return x
+
     def forward(self, x:torch.Tensor)->torch.Tensor:
-        x = self.spatio_conv(x)
-        x = self.temporal_conv(x)
+        if self.spatio_as_2d:
+            x = self.spatio_forward_2d(x)
+        else:
+            x = self.spatio_conv(x)
+
+        if self.temporal_as_1d:
+            x = self.temporal_forward_1d(x)
+        else:
+            x = self.temporal_conv(x)
         return x
 
 class SpatioTemporalResBlock(nn.Module):
@@ -209,17 +255,14 @@ class R2Plus1DNet(nn.Module):
         self.conv3 = SpatioTemporalResLayer(64, 128, 3, dilation = 1, alpha = alpha, layer_size = layer_sizes[1], downsample=True)
         self.conv4 = SpatioTemporalResLayer(128, 256, 3, dilation = 1, alpha = alpha, layer_size = layer_sizes[2], downsample=True)
         self.conv5 = SpatioTemporalResLayer(256, 512, 3, dilation = 1, alpha = alpha, layer_size = layer_sizes[3], downsample=True)
-        self.pool = nn.AdaptiveAvgPool3d(1)
     
     def forward(self, x:torch.Tensor)->torch.Tensor:
-        batch_size = x.size(0)
         x = self.conv1(x)
         x = self.conv2(x)
         x = self.conv3(x)
         x = self.conv4(x)
         x = self.conv5(x)
-        x = self.pool(x)
-        x = x.view(batch_size, -1)
+        x = x.mean(dim = (2,3,4))
         return x
 
 class R2Plus1DClassifier(nn.Module):
@@ -234,6 +277,7 @@ class R2Plus1DClassifier(nn.Module):
         super(R2Plus1DClassifier, self).__init__()
         self.input_size = input_size
         self.res2plus1d = R2Plus1DNet(layer_sizes, alpha = alpha)
+        self.res2plus1d_output_size = None
 
         linear_dims = self.get_res2plus1d_output_size()[1]
 
@@ -250,10 +294,14 @@ class R2Plus1DClassifier(nn.Module):
             self.__load_pretrained_weights()
         
     def get_res2plus1d_output_size(self):
-        input_size = (1, *self.input_size)
-        sample = torch.zeros(input_size)
-        sample_output = self.res2plus1d(sample)
-        return sample_output.size()
+        # shape probe : computed once, without building an autograd graph
+        if self.res2plus1d_output_size is None:
+            input_size = (1, *self.input_size)
+            sample = torch.empty(input_size)
+            with probe_mode(self.res2plus1d):
+                sample_output = self.res2plus1d(sample)
+            self.res2plus1d_output_size = sample_output.size()
+        return self.res2plus1d_output_size
 
     def __load_pretrained_weights(self):
         s_dict = self.state_dict()
@@ -276,8 +324,9 @@ class R2Plus1DClassifier(nn.Module):
 
     def summary(self)->None:
         input_size = (1, *self.input_size)
-        sample = torch.zeros(input_size).to(next(self.parameters()).device)
-        print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
+        sample = torch.empty(input_size).to(next(self.parameters()).device)
+        with probe_mode(self):
+            print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
 
 
 
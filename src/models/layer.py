@@ -3,8 +3,23 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import math
+import warnings
+from contextlib import contextmanager
 from typing import Optional, Tuple, List, Union
 from torch.nn.modules.utils import _triple
+from src.models.resnet import SubBatchNorm3d
+
+# shape probes and summaries run on uninitialized inputs (torch.empty) :
+# eval mode keeps them from writing into BatchNorm running statistics, inference_mode skips autograd
+@contextmanager
+def probe_mode(model : nn.Module):
+    training = model.training
+    model.eval()
+    try:
+        with torch.inference_mode():
+            yield
+    finally:
+        model.train(training)
 
 class ConvBlock(nn.Module):
     def __init__(self, in_channels : int, out_channels : int, kernel_size : int, stride : int = 1, dilation : int = 1, padding : int = 1, bias : bool = False, alpha : float = 0.01):
@@ -17,8 +32,91 @@ class ConvBlock(nn.Module):
         x = self.relu(self.bn(self.conv(x)))
         return x
 
+# torch.jit.script where it is still supported; recent torch deprecates it (FutureWarning on every import),
+# there the eager function is kept and compile_forward fuses the pointwise tail instead
+def script_if_supported(fn):
+    with warnings.catch_warnings(record = True) as caught:
+        warnings.simplefilter("always")
+        scripted = torch.jit.script(fn)
+
+    for w in caught:
+        if not issubclass(w.category, FutureWarning):
+            warnings.warn(w.message, w.category)
+
+    if any(issubclass(w.category, FutureWarning) for w in caught):
+        return fn
+    return scripted
+
+def is_autocast_enabled()->bool:
+    # torch.is_autocast_enabled(device_type) exists from torch 2.4, older versions only have the cuda / cpu variants
+    try:
+        return torch.is_autocast_enabled("cuda") or torch.is_autocast_enabled("cpu")
+    except TypeError:
+        return torch.is_autocast_enabled() or torch.is_autocast_cpu_enabled()
+
+# inference tail of batchnorm (+ residual) + leaky relu, scripted so the pointwise ops run as one fused kernel
+@script_if_supported
+def bn_lrelu_3d(
+    x : torch.Tensor, 
+    running_mean : Optional[torch.Tensor], 
+    running_var : Optional[torch.Tensor], 
+    bn_weight : Optional[torch.Tensor], 
+    bn_bias : Optional[torch.Tensor], 
+    eps : float, 
+    alpha : float, 
+    residual : Optional[torch.Tensor] = None
+    ):
+    x = F.batch_norm(x, running_mean, running_var, bn_weight, bn_bias, False, 0.0, eps)
+    if residual is not None:
+        x = x + residual
+    return F.leaky_relu(x, alpha)
+
+# inference path of conv3d + batchnorm (+ residual) + leaky relu
+@script_if_supported
+def conv_bn_lrelu_3d(
+    x : torch.Tensor, 
+    weight : torch.Tensor, 
+    bias : Optional[torch.Tensor], 
+    stride : List[int], 
+    padding : List[int], 
+    dilation : List[int], 
+    running_mean : Optional[torch.Tensor], 
+    running_var : Optional[torch.Tensor], 
+    bn_weight : Optional[torch.Tensor], 
+    bn_bias : Optional[torch.Tensor], 
+    eps : float, 
+    alpha : float, 
+    residual : Optional[torch.Tensor] = None
+    ):
+    x = F.conv3d(x, weight, bias, stride, padding, dilation)
+    return bn_lrelu_3d(x, running_mean, running_var, bn_weight, bn_bias, eps, alpha, residual)
+
+def use_scripted_conv_bn(module : nn.Module, bn : nn.Module)->bool:
+    # only eval mode with plain BatchNorm3d running statistics, e.g. not after fuse_conv_bn3d
+    # autocast keeps the eager modules : the scripted function would return fp32 where the eager path stays fp16 / bf16
+    return not module.training and type(bn) == nn.BatchNorm3d and bn.running_mean is not None and not is_autocast_enabled()
+
+def scripted_conv_bn_lrelu(x : torch.Tensor, conv : nn.Module, bn : nn.BatchNorm3d, relu : nn.LeakyReLU, residual : Optional[torch.Tensor] = None)->torch.Tensor:
+    # factorized conv : the leading depthwise convs run eagerly, the last (pointwise) conv is scripted with the tail
+    if isinstance(conv, nn.Sequential):
+        for layer in list(conv)[:-1]:
+            x = layer(x)
+        conv = conv[-1]
+
+    return conv_bn_lrelu_3d(
+        x, conv.weight, conv.bias, list(conv.stride), list(conv.padding), list(conv.dilation),
+        bn.running_mean, bn.running_var, bn.weight, bn.bias, bn.eps, relu.negative_slope, residual
+    )
+
+# depthwise-separable conv3d : depthwise (1,k,k) spatial conv followed by a pointwise 1x1x1 conv
+def separable_conv3d(in_channels : int, out_channels : int, kernel_size, stride, padding, dilation = 1, bias : bool = False)->nn.Sequential:
+    return nn.Sequential(
+        nn.Conv3d(in_channels, in_channels, kernel_size = kernel_size, stride = stride, padding = padding, dilation = dilation, groups = in_channels, bias = False),
+        nn.Conv3d(in_channels, out_channels, kernel_size = 1, bias = bias)
+    )
+
 class Conv3dBlock(nn.Module):
-    def __init__(self, in_channels : int, out_channels : int, kernel_size = 3, stride = 1, dilation : int = 1, padding = 1, bias : bool = False, alpha : float = 0.01):
+    def __init__(self, in_channels : int, out_channels : int, kernel_size = 3, stride = 1, dilation : int = 1, padding = 1, bias : bool = False, alpha : float = 0.01, factorized : bool = False):
         super(Conv3dBlock, self).__init__()
 
         if type(stride) == tuple:
@@ -36,24 +134,29 @@ class Conv3dBlock(nn.Module):
         else:
             paddings = (0, padding, padding)
 
-        self.conv = nn.Conv3d(
-            in_channels, 
-            out_channels, 
-            kernel_size = kernel_sizes, 
-            stride =  strides, 
-            padding = paddings, 
-            dilation = dilation, 
-            bias = bias)
+        if factorized:
+            self.conv = separable_conv3d(in_channels, out_channels, kernel_sizes, strides, paddings, dilation, bias)
+        else:
+            self.conv = nn.Conv3d(
+                in_channels, 
+                out_channels, 
+                kernel_size = kernel_sizes, 
+                stride =  strides, 
+                padding = paddings, 
+                dilation = dilation, 
+                bias = bias)
 
         self.bn = nn.BatchNorm3d(out_channels)
         self.relu = nn.LeakyReLU(alpha)
 
     def forward(self, x):
+        if use_scripted_conv_bn(self, self.bn):
+            return scripted_conv_bn_lrelu(x, self.conv, self.bn, self.relu)
         x = self.relu(self.bn(self.conv(x)))
         return x
 
 class Conv3dResBlock(nn.Module):
-    def __init__(self, in_channels : int, out_channels : int, kernel_size : int =  3, stride : int =  1, dilation : int = 1, padding :int =  1, bias : bool = False, alpha : float = 0.01, downsample : bool = True):
+    def __init__(self, in_channels : int, out_channels : int, kernel_size : int =  3, stride : int =  1, dilation : int = 1, padding :int =  1, bias : bool = False, alpha : float = 0.01, downsample : bool = True, factorized : bool = False):
         super(Conv3dResBlock, self).__init__()
         self.downsample = downsample
 
@@ -77,7 +180,8 @@ class Conv3dResBlock(nn.Module):
                 padding = self.padding,
                 dilation=dilation,
                 alpha = alpha,
-                bias = bias
+                bias = bias,
+                factorized = factorized
             )
     
         self.conv1 = Conv3dBlock(
@@ -88,24 +192,32 @@ class Conv3dResBlock(nn.Module):
             stride=self.stride,
             dilation=dilation,
             alpha = alpha,
-            bias = bias
+            bias = bias,
+            factorized = factorized
         )
 
-        self.conv2 = nn.Conv3d(out_channels, out_channels, self.kernel_size, (1,1,1), (0,pad,pad), dilation, bias = bias )
+        if factorized:
+            self.conv2 = separable_conv3d(out_channels, out_channels, self.kernel_size, (1,1,1), (0,pad,pad), dilation, bias = bias)
+        else:
+            self.conv2 = nn.Conv3d(out_channels, out_channels, self.kernel_size, (1,1,1), (0,pad,pad), dilation, bias = bias )
         self.bn2 = nn.BatchNorm3d(out_channels)
         self.relu2 = nn.LeakyReLU(alpha)
 
     def forward(self, x:torch.Tensor):
         res = self.conv1(x)
-        res = self.bn2(self.conv2(res))
         if self.downsample:
             xi =  self.downsample_conv(x)
         else:
             xi = x
+
+        if use_scripted_conv_bn(self, self.bn2):
+            return scripted_conv_bn_lrelu(res, self.conv2, self.bn2, self.relu2, residual = xi)
+
+        res = self.bn2(self.conv2(res))
         return self.relu2(xi + res)
 
 class SpatioTemporalConv(nn.Module):
-    def __init__(self, in_channels : int, out_channels : int, kernel_size = (3,1,1), stride = (1,1,1), dilation : int = 1, padding = (1,1,1), bias : bool = False, alpha : float = 0.01, is_first : bool = False):
+    def __init__(self, in_channels : int, out_channels : int, kernel_size = (3,1,1), stride = (1,1,1), dilation : int = 1, padding = (1,1,1), bias : bool = False, alpha : float = 0.01, is_first : bool = False, temporal_as_1d : bool = False):
         super(SpatioTemporalConv, self).__init__()
 
         if type(kernel_size) == int:
@@ -148,9 +260,47 @@ class SpatioTemporalConv(nn.Module):
             self.spatio_conv = Conv3dBlock(in_channels, middle_channels, spatio_kernel_size, spatio_stride, dilation, spatio_padding, bias, alpha)
             self.temporal_conv = Conv3dBlock(middle_channels, out_channels, temporal_kernel_size, temporal_stride, dilation, temporal_padding, bias, alpha)
 
+        # spatial-only kernel (1,kH,kW) : run as conv2d over (B*T,C,H,W), cuDNN 2D kernels are better tuned than conv3d
+        self.spatio_as_2d = spatio_kernel_size[0] == 1 and spatio_stride[0] == 1 and spatio_padding[0] == 0
+
+        # temporal (kT,1,1) kernel run as conv1d over (B*H*W,C,T) : opt-in, the permutes around conv1d cost two extra copies
+        # and it measured 2-3x slower than conv3d on cpu; off by default until it is shown to pay off on a given backend
+        self.temporal_as_1d = temporal_as_1d
+
+    def spatio_forward_2d(self, x:torch.Tensor)->torch.Tensor:
+        conv = self.spatio_conv.conv
+        B,C,T,H,W = x.size()
+        x = x.transpose(1,2).reshape(B*T,C,H,W)
+        x = F.conv2d(x, conv.weight.squeeze(2), conv.bias, conv.stride[1:], conv.padding[1:], conv.dilation[1:])
+        x = x.view(B,T,x.size(1),x.size(2),x.size(3)).transpose(1,2).contiguous()
+
+        bn, relu = self.spatio_conv.bn, self.spatio_conv.relu
+        if use_scripted_conv_bn(self, bn):
+            return bn_lrelu_3d(x, bn.running_mean, bn.running_var, bn.weight, bn.bias, bn.eps, relu.negative_slope)
+        return relu(bn(x))
+
+    def temporal_forward_1d(self, x:torch.Tensor)->torch.Tensor:
+        conv = self.temporal_conv.conv
+        B,C,T,H,W = x.size()
+        x = x.permute(0,3,4,1,2).reshape(B*H*W,C,T)
+        x = F.conv1d(x, conv.weight.view(conv.out_channels, conv.in_channels, -1), conv.bias, conv.stride[0], conv.padding[0], conv.dilation[0])
+        x = x.view(B,H,W,x.size(1),x.size(2)).permute(0,3,4,1,2).contiguous()
+
+        bn, relu = self.temporal_conv.bn, self.temporal_conv.relu
+        if use_scripted_conv_bn(self, bn):
+            return bn_lrelu_3d(x, bn.running_mean, bn.running_var, bn.weight, bn.bias, bn.eps, relu.negative_slope)
+        return relu(bn(x))
+
     def forward(self, x):
-        x = self.spatio_conv(x)
-        x = self.temporal_conv(x)
+        if self.spatio_as_2d:
+            x = self.spatio_forward_2d(x)
+        else:
+            x = self.spatio_conv(x)
+
+        if self.temporal_as_1d:
+            x = self.temporal_forward_1d(x)
+        else:
+            x = self.temporal_conv(x)
         return x
 
 class SpatioTemporalResBlock(nn.Module):
@@ -196,6 +346,101 @@ class SpatioTemporalResLayer(nn.Module):
             x = block(x)
         return x
 
+# fold BatchNorm3d into the preceding Conv3d for inference
+# modules in this repo register each conv directly before the bn consuming its output
+# per-channel (running_mean, scale, shift) of an eval-mode BatchNorm3d / SubBatchNorm3d, None if it can not be folded
+def bn3d_fold_params(bn : nn.Module)->Optional[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+    if isinstance(bn, SubBatchNorm3d):
+        # eval mode : the (aggregated) bn without affine, followed by the SubBatchNorm3d affine
+        weight, bias = (bn.weight, bn.bias) if bn.affine else (None, None)
+        bn = bn.bn
+    elif type(bn) == nn.BatchNorm3d:
+        weight, bias = (bn.weight, bn.bias) if bn.affine else (None, None)
+    else:
+        return None
+
+    if bn.running_mean is None:
+        return None
+
+    inv_std = 1.0 / torch.sqrt(bn.running_var + bn.eps)
+    scale = weight * inv_std if weight is not None else inv_std
+    shift = bias if bias is not None else torch.zeros_like(bn.running_mean)
+    return bn.running_mean, scale, shift
+
+def fuse_conv_bn3d(module : nn.Module)->None:
+    children = list(module.named_children())
+    for (_, conv), (bn_name, bn) in zip(children[:-1], children[1:]):
+        # factorized conv (separable_conv3d) : the bn follows its last conv
+        if isinstance(conv, nn.Sequential) and len(conv) > 0:
+            conv = conv[-1]
+
+        if not isinstance(conv, nn.Conv3d):
+            continue
+
+        with torch.no_grad():
+            params = bn3d_fold_params(bn)
+            if params is None:
+                continue
+            running_mean, scale, shift = params
+            bias = conv.bias if conv.bias is not None else torch.zeros_like(running_mean)
+
+            conv.weight.copy_(conv.weight * scale.view(-1,1,1,1,1))
+            conv.bias = nn.Parameter((bias - running_mean) * scale + shift)
+
+        setattr(module, bn_name, nn.Identity())
+
+    for child in module.children():
+        fuse_conv_bn3d(child)
+
+# fold BatchNorm1d into the preceding Linear of the mlp heads for inference
+def fuse_linear_bn1d(module : nn.Module)->None:
+    children = list(module.named_children())
+    for (_, linear), (bn_name, bn) in zip(children[:-1], children[1:]):
+        if not isinstance(linear, nn.Linear) or type(bn) != nn.BatchNorm1d or bn.running_mean is None:
+            continue
+
+        with torch.no_grad():
+            scale = bn.weight / torch.sqrt(bn.running_var + bn.eps) if bn.affine else 1.0 / torch.sqrt(bn.running_var + bn.eps)
+            shift = bn.bias if bn.affine else torch.zeros_like(bn.running_mean)
+            bias = linear.bias if linear.bias is not None else torch.zeros_like(bn.running_mean)
+
+            linear.weight.copy_(linear.weight * scale.unsqueeze(1))
+            linear.bias = nn.Parameter((bias - bn.running_mean) * scale + shift)
+
+        setattr(module, bn_name, nn.Identity())
+
+    for child in module.children():
+        fuse_linear_bn1d(child)
+
+# analytic output shape of conv3d / pool3d : (T,H,W) -> (T',H',W')
+def compute_conv3d_out_shape(in_shape : Tuple[int,int,int], kernel_size, stride, padding, dilation = 1)->Tuple[int,int,int]:
+    kernel_size, stride, padding, dilation = map(_triple, (kernel_size, stride, padding, dilation))
+    return tuple(
+        (size + 2 * p - d * (k - 1) - 1) // s + 1 for size, k, s, p, d in zip(in_shape, kernel_size, stride, padding, dilation)
+    )
+
+# output shape (C,T,H,W) of a sequential chain of conv3d / pool3d layers, computed without any forward pass
+# returns None if the chain contains a layer whose output shape is not derived here (e.g. adaptive pooling)
+def infer_conv3d_chain_shape(in_shape : Tuple[int,int,int,int], layers : List[nn.Module])->Optional[Tuple[int,int,int,int]]:
+    C, T, H, W = in_shape
+    shape = (T, H, W)
+    for layer in layers:
+        if isinstance(layer, nn.Sequential):
+            chain_shape = infer_conv3d_chain_shape((C, *shape), list(layer))
+            if chain_shape is None:
+                return None
+            C, shape = chain_shape[0], chain_shape[1:]
+        elif isinstance(layer, nn.Conv3d) and layer.padding_mode == "zeros" and not isinstance(layer.padding, str):
+            shape = compute_conv3d_out_shape(shape, layer.kernel_size, layer.stride, layer.padding, layer.dilation)
+            C = layer.out_channels
+        elif isinstance(layer, nn.MaxPool3d) and not layer.ceil_mode:
+            shape = compute_conv3d_out_shape(shape, layer.kernel_size, layer.stride, layer.padding, layer.dilation)
+        elif isinstance(layer, (nn.BatchNorm3d, nn.ReLU, nn.LeakyReLU, nn.Identity)):
+            continue
+        else:
+            return None
+    return (C, *shape)
+
 # Spatial transformer layer
 class SpatialTransformer(nn.Module):
     def __init__(self, 
@@ -1,3 +1,4 @@
+import math
 import torch 
 import torch.nn as nn
 from typing import Tuple, List
@@ -8,6 +9,78 @@ from src.models.slowfast import *
 from src.models.unet3d import UNet3D
 from pytorch_model_summary import summary
 
+def set_backend_flags()->None:
+    # process-wide backend setup for the compiled classifier forwards, called once by the train / evaluate scripts :
+    # cudnn autotuning, TF32 matmul / conv and a larger dynamo recompile limit
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    if hasattr(torch, "_dynamo"):
+        torch._dynamo.config.cache_size_limit = 128
+
+def compile_forward(model : nn.Module, mode : str = "max-autotune-no-cudagraphs")->None:
+    # nn.Module.compile (torch >= 2.2) keeps forward as a class attribute, so torch.save / deepcopy are unaffected
+    # eager forward is kept on older versions; backend flags are left to set_backend_flags, called by the train scripts
+    if not hasattr(nn.Module, "compile"):
+        return
+
+    model.compile(mode = mode, fullgraph = False, dynamic = False)
+
+def capture_forward_graph(model : nn.Module, input_shape : Tuple[int,int,int,int], batch_size : int, n_warmup : int = 3)->None:
+    # fixed-shape inference : replaying a cuda graph removes per-kernel launch overhead
+    param = next(model.parameters())
+    model.eval()
+    model.static_in = torch.empty((batch_size, *input_shape), device = param.device, dtype = param.dtype)
+
+    with torch.no_grad():
+        # warmup on a side stream before capture, as required by torch.cuda.graph
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(n_warmup):
+                model.forward(model.static_in)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        model.graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(model.graph):
+            model.static_out = model.forward(model.static_in)
+
+class FuseBNMixin:
+    # inference only : running statistics of BatchNorm3d / SubBatchNorm3d / BatchNorm1d are folded into conv / linear weights
+    fused = False
+
+    def fuse_bn(self)->None:
+        if self.fused:
+            return
+        self.eval()
+        fuse_conv_bn3d(self)
+        fuse_linear_bn1d(self)
+        self.fused = True
+
+class ChannelsLast3dMixin:
+    # NDHWC layout lets cuDNN pick its faster conv3d kernels, mostly with fp16
+    # forward converts its input to channels_last_3d once this flag is set
+    channels_last = False
+
+    def to_channels_last_3d(self)->None:
+        self.to(memory_format = torch.channels_last_3d)
+        self.channels_last = True
+
+class CUDAGraphMixin:
+    # capture_graph records the eval forward for a fixed batch size, forward_graph replays it on a copy of x
+    def capture_graph(self, batch_size : int)->None:
+        capture_forward_graph(self, self.input_shape, batch_size)
+
+    def forward_graph(self, x:torch.Tensor)->torch.Tensor:
+        if getattr(self, "graph", None) is None:
+            raise RuntimeError("forward_graph called before capture_graph")
+        # copy_ would silently broadcast e.g. a batch of 1 over the whole captured batch
+        if x.shape != self.static_in.shape:
+            raise ValueError("forward_graph expects input of shape {}, got {}".format(tuple(self.static_in.shape), tuple(x.shape)))
+        self.static_in.copy_(x)
+        self.graph.replay()
+        return self.static_out.clone()
+
 class R2Plus1DNet(nn.Module):
     def __init__(self, layer_sizes : List[int] = [4,4,4,4], alpha : float = 0.01):
         super(R2Plus1DNet, self).__init__()
@@ -17,32 +90,33 @@ class R2Plus1DNet(nn.Module):
         self.conv4 = SpatioTemporalResLayer(128, 256, 3, dilation = 1, alpha = alpha, layer_size = layer_sizes[2], downsample=True)
         self.conv5 = SpatioTemporalResLayer(256, 512, 3, dilation = 1, alpha = alpha, layer_size = layer_sizes[3], downsample=True)
 
-        self.pool = nn.AdaptiveAvgPool3d(1)
     
     def forward(self, x):
-        batch_size = x.size(0)
         x = self.conv1(x)
         x = self.conv2(x)
         x = self.conv3(x)
         x = self.conv4(x)
         x = self.conv5(x)
-        x = self.pool(x)
-        x = x.view(batch_size, -1)
+        x = x.mean(dim = (2,3,4))
 
         return x
 
-class R2Plus1DClassifier(nn.Module):
+class R2Plus1DClassifier(FuseBNMixin, CUDAGraphMixin, nn.Module):
     def __init__(
         self, 
         input_size : Tuple[int, int, int, int] = (3, 8, 112, 112),
         num_classes : int = 2, 
         layer_sizes : List[int] = [4,4,4,4], 
         pretrained : bool = False, 
-        alpha : float = 0.01
+        alpha : float = 0.01,
+        compile : bool = True,
+        use_amp : bool = False
         ):
         super(R2Plus1DClassifier, self).__init__()
         self.input_size = input_size
+        self.use_amp = use_amp
         self.res2plus1d = R2Plus1DNet(layer_sizes, alpha = alpha)
+        self.res2plus1d_output_size = None
 
         linear_dims = self.get_res2plus1d_output_size()[1]
 
@@ -57,12 +131,19 @@ class R2Plus1DClassifier(nn.Module):
 
         if pretrained:
             self.__load_pretrained_weights()
+
+        if compile:
+            compile_forward(self)
         
     def get_res2plus1d_output_size(self):
-        input_size = (1, *self.input_size)
-        sample = torch.zeros(input_size)
-        sample_output = self.res2plus1d(sample)
-        return sample_output.size()
+        # shape probe : computed once, without building an autograd graph
+        if self.res2plus1d_output_size is None:
+            input_size = (1, *self.input_size)
+            sample = torch.empty(input_size)
+            with probe_mode(self.res2plus1d):
+                sample_output = self.res2plus1d(sample)
+            self.res2plus1d_output_size = sample_output.size()
+        return self.res2plus1d_output_size
 
     def __load_pretrained_weights(self):
         s_dict = self.state_dict()
@@ -79,20 +160,28 @@ class R2Plus1DClassifier(nn.Module):
                 m.bias.data.zero_()
 
     def forward(self, x)->torch.Tensor:
-        x = self.res2plus1d(x)
-        x = self.linear(x)
+        with torch.autocast("cuda", dtype = torch.float16, enabled = self.use_amp):
+            x = self.res2plus1d(x)
+        # linear head is kept in fp32
+        x = self.linear(x.float())
         return x
 
+    def capture_graph(self, batch_size : int)->None:
+        # the sample shape is kept as input_size here
+        capture_forward_graph(self, self.input_size, batch_size)
+
     def summary(self)->None:
         input_size = (1, *self.input_size)
-        sample = torch.zeros(input_size)
-        print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
+        sample = torch.empty(input_size)
+        with probe_mode(self):
+            print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
 
-class VideoSpatioEncoder(nn.Module):
+class VideoSpatioEncoder(ChannelsLast3dMixin, nn.Module):
     def __init__(
         self, 
         input_shape : Tuple[int,int,int,int] = (3, 8, 112, 112),
         alpha : float = 0.01,
+        factorized : bool = True,
         ):
         super(VideoSpatioEncoder, self).__init__()
         self.input_shape = input_shape
@@ -107,31 +196,58 @@ class VideoSpatioEncoder(nn.Module):
             padding = 1, 
             bias = False, 
             alpha = alpha, 
-            downsample  = True
+            downsample  = True,
+            factorized = factorized
         )
 
+        # strided max pooling : downsamples instead of a full-resolution 3x3 max that only trims 2 pixels
         self.pooling_block1 = nn.MaxPool3d(
             kernel_size = (1, 3, 3),
-            stride = (1, 1, 1),
-            padding= (0, 0, 0)
+            stride = (1, 2, 2),
+            padding= (0, 1, 1)
         )
 
-        self.conv_block2 = Conv3dResBlock(64, 128, 3, 2, 1, 1, False, alpha, True)
-        self.pooling_block2 = nn.MaxPool3d((1, 3, 3),(1, 1, 1),(0,0,0))
+        self.conv_block2 = Conv3dResBlock(64, 128, 3, 2, 1, 1, False, alpha, True, factorized)
+        self.pooling_block2 = nn.MaxPool3d((1, 3, 3),(1, 2, 2),(0,1,1))
+
+        self.conv_block3 = Conv3dResBlock(128, 256, 3, 2, 1, 1, False, alpha, True, factorized)
+        self.pooling_block3 = nn.MaxPool3d((1, 3, 3),(1, 2, 2),(0,1,1))
 
-        self.conv_block3 = Conv3dResBlock(128, 256, 3, 2, 1, 1, False, alpha, True)
-        self.pooling_block3 = nn.MaxPool3d((1, 3, 3),(1, 1, 1),(0,0,0))
+        self.conv_block4 = Conv3dResBlock(256, 512, 3, 2, 1, 1, False, alpha, True, factorized)
+        self.output_size = None
 
-        self.conv_block4 = Conv3dResBlock(256, 512, 3, 2, 1, 1, False, alpha, True)
+    def get_main_path_layers(self)->List[nn.Module]:
+        layers = []
+        for conv_block, pooling_block in [
+            (self.conv_block1, self.pooling_block1), 
+            (self.conv_block2, self.pooling_block2), 
+            (self.conv_block3, self.pooling_block3), 
+            (self.conv_block4, None)
+            ]:
+            layers.extend([conv_block.conv1.conv, conv_block.conv2])
+            if pooling_block is not None:
+                layers.append(pooling_block)
+        return layers
 
     def get_output_size(self):
-        input_shape = (1, *(self.input_shape))
-        device = next(self.conv_block1.parameters()).device
-        sample = torch.zeros(input_shape).to(device)
-        sample_output = self.forward(sample)
-        return sample_output.size()
-        
+        # output size computed analytically from the conv / pool chain, sample forward only as a fallback
+        if self.output_size is None:
+            out_shape = infer_conv3d_chain_shape(self.input_shape, self.get_main_path_layers())
+            if out_shape is not None:
+                self.output_size = torch.Size((1, self.seq_len, math.prod(out_shape) // self.seq_len))
+                return self.output_size
+
+            input_shape = (1, *(self.input_shape))
+            device = next(self.conv_block1.parameters()).device
+            sample = torch.empty(input_shape).to(device)
+            with probe_mode(self):
+                sample_output = self.forward(sample)
+            self.output_size = sample_output.size()
+        return self.output_size
+
     def forward(self, x:torch.Tensor):
+        if self.channels_last:
+            x = x.contiguous(memory_format = torch.channels_last_3d)
         x = self.conv_block1(x)
         x = self.pooling_block1(x)
         x = self.conv_block2(x)
@@ -139,7 +255,7 @@ class VideoSpatioEncoder(nn.Module):
         x = self.conv_block3(x)
         x = self.pooling_block3(x)
         x = self.conv_block4(x)
-        x = x.view(x.size(0),self.seq_len, -1)
+        x = x.reshape(x.size(0),self.seq_len, -1)
         return x
     
 class ResNet50(ResNet2DPlus1D):
@@ -155,7 +271,7 @@ class ResNet50(ResNet2DPlus1D):
         x = self.layer4(x)
         return x
 
-class SITSBertSpatialEncoder(nn.Module):
+class SITSBertSpatialEncoder(ChannelsLast3dMixin, nn.Module):
     def __init__(
         self, 
         input_shape : Tuple[int,int,int,int] = (3, 8, 112, 112),
@@ -167,20 +283,40 @@ class SITSBertSpatialEncoder(nn.Module):
         self.input_shape = input_shape
         self.seq_len = input_shape[1]
         self.resnet = ResNet50(block = block, layers = layers, alpha = alpha, in_channels = input_shape[0])
+        self.output_size = None
+
+    def get_main_path_layers(self)->List[nn.Module]:
+        # stem conv / maxpool and the conv1-conv2-conv3 chain of every bottleneck, the SE branch does not change the shape
+        layers = [self.resnet.layer0]
+        for layer in [self.resnet.layer1, self.resnet.layer2, self.resnet.layer3, self.resnet.layer4]:
+            for block in layer:
+                layers.extend([block.conv1, block.conv2, block.conv3])
+        return layers
 
     def get_output_size(self):
-        input_shape = (4, *(self.input_shape))
-        device = next(self.resnet.parameters()).device
-        sample = torch.zeros(input_shape).to(device)
-        sample_output = self.forward(sample)
-        return sample_output.size()
-        
+        # output size computed analytically from the conv / pool chain, sample forward only as a fallback
+        if self.output_size is None:
+            out_shape = infer_conv3d_chain_shape(self.input_shape, self.get_main_path_layers())
+            if out_shape is not None:
+                self.output_size = torch.Size((1, self.seq_len, math.prod(out_shape) // self.seq_len))
+                return self.output_size
+
+            input_shape = (1, *(self.input_shape))
+            device = next(self.resnet.parameters()).device
+            sample = torch.empty(input_shape).to(device)
+            with probe_mode(self):
+                sample_output = self.forward(sample)
+            self.output_size = sample_output.size()
+        return self.output_size
+
     def forward(self, x:torch.Tensor):
+        if self.channels_last:
+            x = x.contiguous(memory_format = torch.channels_last_3d)
         x = self.resnet(x)
-        x = x.view(x.size(0), self.seq_len, -1)
+        x = x.reshape(x.size(0), self.seq_len, -1)
         return x
 
-class SlowFastEncoder(nn.Module):
+class SlowFastEncoder(ChannelsLast3dMixin, nn.Module):
     def __init__(
             self, 
             input_shape : Tuple[int,int,int,int] = (3, 8, 112, 112),
@@ -189,7 +325,8 @@ class SlowFastEncoder(nn.Module):
             alpha : int = 4,
             p : float = 0.5,
             tau_fast : int = 1,
-            base_bn_splits : Optional[int] = None
+            base_bn_splits : Optional[int] = None,
+            parallel_streams : bool = True
         ):
         super(SlowFastEncoder, self).__init__()
         self.input_shape = input_shape
@@ -197,24 +334,50 @@ class SlowFastEncoder(nn.Module):
         self.in_channels = input_shape[0]
         self.alpha = alpha
         self.tau_fast = tau_fast
+        self.base_bn_splits = base_bn_splits
+        self.parallel_streams = parallel_streams
+        self.output_size = None
 
         self.slownet = resnet50_s(block = block, layers = layers, alpha = alpha, in_channels = input_shape[0], slow = 1, base_bn_splits = base_bn_splits)
         self.fastnet = resnet50_f(block = block, layers = layers, alpha = alpha, in_channels = input_shape[0], slow = 0, base_bn_splits = base_bn_splits)
         self.dropout = nn.Dropout(p = p)
+        self.build_temporal_index(self.seq_len)
         
     def get_output_size(self):
-        input_shape = (8, *(self.input_shape))
-        device = next(self.parameters()).device
-        sample = torch.zeros(input_shape).to(device)
-        sample_output = self.forward(sample)
-        return sample_output.size()
+        # shape probe : computed once, without building an autograd graph
+        if self.output_size is None:
+            input_shape = (1, *(self.input_shape))
+            device = next(self.parameters()).device
+            sample = torch.empty(input_shape).to(device)
+            with probe_mode(self):
+                sample_output = self.forward(sample)
+            self.output_size = sample_output.size()
+        return self.output_size
+
+    def build_temporal_index(self, seq_len : int, device : Optional[torch.device] = None)->None:
+        # frame indices of each pathway, rebuilt only when the clip length or the input device changes
+        tau_slow = self.tau_fast * self.alpha
+        self.index_seq_len = seq_len
+        self.register_buffer("slow_index", torch.arange(0, seq_len, tau_slow, device = device), persistent = False)
+        self.register_buffer("fast_index", torch.arange(0, seq_len, self.tau_fast, device = device), persistent = False)
+
+    def gather_frames(self, x : torch.Tensor, index : torch.Tensor)->torch.Tensor:
+        # gather into contiguous tensors so the first conv of each pathway does not read strided views
+        if self.channels_last:
+            # gathering T of the (N,T,H,W,C) view gives a channels_last_3d result in one copy
+            return x.permute(0,2,3,4,1).index_select(1, index).permute(0,4,1,2,3)
+        return x.index_select(2, index)
 
     def split_slow_fast(self, x : torch.Tensor):
-        tau_fast = self.tau_fast
-        tau_slow = tau_fast * self.alpha
+        if x.size(2) != self.index_seq_len or self.slow_index.device != x.device:
+            self.build_temporal_index(x.size(2), x.device)
 
-        x_slow = x[:,:,::tau_slow, :, :]
-        x_fast = x[:,:,::tau_fast, :, :]
+        x_slow = self.gather_frames(x, self.slow_index)
+
+        if self.tau_fast == 1:
+            x_fast = x
+        else:
+            x_fast = self.gather_frames(x, self.fast_index)
 
         # print("x_slow : ", x_slow.size())
         # print("x_fast : ", x_fast.size())
@@ -228,15 +391,46 @@ class SlowFastEncoder(nn.Module):
         '''
 
         return x_slow, x_fast
-        
+
+    def forward_parallel(self, x_slow : torch.Tensor, x_fast : torch.Tensor):
+        # fast pathway and slow stem are independent : run them on two cuda streams, then join on the current stream
+        current_stream = torch.cuda.current_stream()
+        fast_stream = torch.cuda.Stream()
+        slow_stream = torch.cuda.Stream()
+        fast_stream.wait_stream(current_stream)
+        slow_stream.wait_stream(current_stream)
+
+        with torch.cuda.stream(fast_stream):
+            x_fast, laterals = self.fastnet(x_fast)
+
+        with torch.cuda.stream(slow_stream):
+            x_slow = self.slownet.layer0(x_slow)
+
+        current_stream.wait_stream(fast_stream)
+        current_stream.wait_stream(slow_stream)
+
+        # tensors allocated on the side streams are used on the current stream from here
+        for output in [x_fast, x_slow, *laterals]:
+            output.record_stream(current_stream)
+
+        x_slow = self.slownet.forward_layers(x_slow, laterals)
+        return x_slow, x_fast
+
     def forward(self, x:torch.Tensor):
+        if self.channels_last:
+            x = x.contiguous(memory_format = torch.channels_last_3d)
         x_slow, x_fast = self.split_slow_fast(x)
-        x_fast, laterals = self.fastnet(x_fast)
 
-        # for lateral in laterals:
-        #     print("lateral size : ", lateral.size())
+        if self.parallel_streams and x.is_cuda:
+            x_slow, x_fast = self.forward_parallel(x_slow, x_fast)
+        else:
+            x_fast, laterals = self.fastnet(x_fast)
+
+            # for lateral in laterals:
+            #     print("lateral size : ", lateral.size())
+
+            x_slow = self.slownet((x_slow, laterals))
 
-        x_slow = self.slownet((x_slow, laterals))
         x = torch.cat([x_slow, x_fast], dim = 1)
         x = self.dropout(x)
         return x
@@ -244,12 +438,13 @@ class SlowFastEncoder(nn.Module):
     def summary(self)->None:
         input_shape = (8, *(self.input_shape))
         device = next(self.parameters()).device
-        sample = torch.zeros(input_shape).to(device)
-        print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
+        sample = torch.empty(input_shape).to(device)
+        with probe_mode(self):
+            print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
 
 from src.utils.preprocessing import background_removal
 
-class SlowFastDisruptionClassifier(nn.Module):
+class SlowFastDisruptionClassifier(FuseBNMixin, CUDAGraphMixin, nn.Module):
     def __init__(
         self, 
         input_shape : Tuple[int,int,int,int] = (3, 8, 112, 112),
@@ -261,11 +456,17 @@ class SlowFastDisruptionClassifier(nn.Module):
         num_classes : int = 2,
         tau_fast : int = 1,
         base_bn_splits : Optional[int] = None,
+        compile : bool = True,
+        use_amp : bool = False,
+        amp_dtype : torch.dtype = torch.float16,
+        parallel_streams : bool = True,
     ):
         super(SlowFastDisruptionClassifier, self).__init__()
         self.input_shape = input_shape
+        self.use_amp = use_amp
+        self.amp_dtype = amp_dtype
         self.base_bn_splits = base_bn_splits
-        self.slowfast = SlowFastEncoder(input_shape, block, layers, alpha, p, tau_fast = tau_fast, base_bn_splits = base_bn_splits)
+        self.slowfast = SlowFastEncoder(input_shape, block, layers, alpha, p, tau_fast = tau_fast, base_bn_splits = base_bn_splits, parallel_streams = parallel_streams)
         slowfast_output_dim = self.slowfast.get_output_size()[-1]
         self.classifier = nn.Sequential(
             nn.Linear(slowfast_output_dim, mlp_hidden),
@@ -277,33 +478,51 @@ class SlowFastDisruptionClassifier(nn.Module):
             nn.Linear(mlp_hidden, num_classes)
         )
 
+        if compile:
+            compile_forward(self)
+
     def forward(self, x:torch.Tensor):
         #x = background_removal(x, self.input_shape[1], self.input_shape[2], self.input_shape[3], rank = 2, some  = True, compute_uv = True)
-        x = self.slowfast(x)
-        x = self.classifier(x)
+        with torch.autocast("cuda", dtype = self.amp_dtype, enabled = self.use_amp):
+            x = self.slowfast(x)
+        # classifier head is kept in fp32
+        x = self.classifier(x.float())
         return x
 
     def update_bn_splits_long_cycle(self, long_cycle_bn_scale):
         for m in self.modules():
             if isinstance(m, SubBatchNorm3d):
-                m.num_splits = self.base_bn_splits * long_cycle_bn_scale
-                m.split_bn = nn.BatchNorm3d(num_features = m.num_features * m.num_splits, affine = False).to(m.weight.device)
+                m.set_num_splits(self.base_bn_splits * long_cycle_bn_scale)
         
         return self.base_bn_splits * long_cycle_bn_scale
     
+    def quantize_classifier(self)->None:
+        # int8 dynamic quantization of the (bn folded) linear head, runs on cpu only
+        device = next(self.parameters()).device
+        if device.type != "cpu":
+            raise ValueError("quantize_classifier requires the model on cpu, got {}".format(device))
+        self.fuse_bn()
+        self.classifier = torch.quantization.quantize_dynamic(self.classifier, {nn.Linear}, dtype = torch.qint8)
+
     def summary(self)->None:
         input_size = (8, *self.input_shape)
-        sample = torch.zeros(input_size)
-        print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
+        sample = torch.empty(input_size)
+        with probe_mode(self):
+            print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
 
-class SBERTDisruptionClassifier(nn.Module):
-    def __init__(self, spatio_encoder : VideoSpatioEncoder, sbert : SBERT, mlp_hidden : int, num_classes : int = 2, alpha : float = 0.01):
+class SBERTDisruptionClassifier(FuseBNMixin, nn.Module):
+    def __init__(self, spatio_encoder : VideoSpatioEncoder, sbert : SBERT, mlp_hidden : int, num_classes : int = 2, alpha : float = 0.01, compile : bool = True, use_amp : bool = False):
         super(SBERTDisruptionClassifier, self).__init__()
+        self.use_amp = use_amp
         self.spatio_encoder = spatio_encoder
         self.sbert = sbert
+        # day-of-year index (1, max_len) built once, moved along with the model by .to()
+        self.register_buffer("_doy", torch.arange(1, sbert.max_len + 1, dtype = torch.int32).unsqueeze(0), persistent = False)
         enc_dims = self.get_sbert_output()
         self.classifier = MulticlassClassifier(enc_dims, mlp_hidden, seq_len = sbert.max_len, num_classes = num_classes, alpha = alpha)
-        self.device = next(self.sbert.parameters()).device
+
+        if compile:
+            compile_forward(self)
 
     def get_spatio_encoding(self, inputs : torch.Tensor):
 
@@ -315,32 +534,35 @@ class SBERTDisruptionClassifier(nn.Module):
     def get_sbert_output(self):
         seq_len = self.sbert.max_len
         num_features = self.sbert.num_features
-        doy_dims = seq_len
 
-        sample_x = torch.zeros((1, seq_len, num_features))
-        sample_doy = torch.IntTensor(list(map(int, range(1, doy_dims + 1)))).repeat(1, 1)
-        sample_mask = torch.IntTensor(list(map(int, range(1, doy_dims + 1)))).repeat(1, 1)
-        sample_output = self.sbert.forward(sample_x, sample_doy, sample_mask)
+        sample_x = torch.empty((1, seq_len, num_features))
+        sample_doy = self._doy
+        sample_mask = self._doy
+        with probe_mode(self.sbert):
+            sample_output = self.sbert.forward(sample_x, sample_doy, sample_mask)
 
         return sample_output.size(2)
 
     def forward(self, x : torch.Tensor):
         # doy : (batch_size, doy_dims)
         # x : (batch_size, seq_len, num_features)
-        x = self.spatio_encoder(x)
-        doy = torch.IntTensor(list(map(int, range(1, self.sbert.max_len + 1)))).repeat(x.size(0), 1).to(self.device)
-        mask  = None
-        x = self.sbert(x, doy, mask)
-        x = self.classifier(x)
+        with torch.autocast("cuda", dtype = torch.float16, enabled = self.use_amp):
+            x = self.spatio_encoder(x)
+            doy = self._doy.expand(x.size(0), -1)
+            mask  = None
+            x = self.sbert(x, doy, mask)
+        # classifier head is kept in fp32
+        x = self.classifier(x.float())
         return x
 
     def summary(self)->None:
         input_shape = (8, *(self.spatio_encoder.input_shape))
         device = next(self.parameters()).device
-        sample = torch.zeros(input_shape).to(device)
-        print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
+        sample = torch.empty(input_shape).to(device)
+        with probe_mode(self):
+            print(summary(self, sample, max_depth = None, show_parent_layers = True, show_input = True))
         
-class Unet3DClassifier(nn.Module):
+class Unet3DClassifier(FuseBNMixin, CUDAGraphMixin, nn.Module):
     def __init__(
         self, 
         input_shape : Tuple[int,int,int,int] = (3, 8, 112, 112), 
@@ -348,16 +570,19 @@ class Unet3DClassifier(nn.Module):
         mlp_hidden : int = 128, 
         num_classes : int = 2, 
         alpha : int = 4,
-        resnet_layers : List[int] = [1,2,2,1]
+        resnet_layers : List[int] = [1,2,2,1],
+        compile : bool = True,
+        use_amp : bool = False
         ):
         super(Unet3DClassifier, self).__init__()
+        self.use_amp = use_amp
         self.spatio_encoder = UNet3D(in_channel = 3, n_classes=Unet3D_class, feats = feats, pad_value = None)
         self.input_shape = input_shape
         enc_output = self.get_encoder_output()
         
-        self.resnet = ResNet50(block = Bottleneck2DPlus1D, layers = resnet_layers, alpha = alpha, in_channels = enc_output[1])
+        self.resnet = ResNet50(block = Bottleneck2DPlus1D, layers = resnet_layers, alpha = alpha, in_channels = enc_output.size(1))
         
-        classifier_dims = self.get_resnet_output()[-1]
+        classifier_dims = self.get_resnet_output(enc_output)[-1]
         
         self.classifier = nn.Sequential(
             nn.Linear(classifier_dims, mlp_hidden),
@@ -366,27 +591,34 @@ class Unet3DClassifier(nn.Module):
             nn.Linear(mlp_hidden, num_classes)
         )
 
-    def get_encoder_output(self):
-        sample_input = torch.zeros((4, *self.input_shape))
-        sample_output = self.spatio_encoder(sample_input)
-        return sample_output.size()
+        if compile:
+            compile_forward(self)
+
+    def get_encoder_output(self)->torch.Tensor:
+        # the encoder output is kept and reused to probe the resnet, instead of a second UNet3D forward
+        sample_input = torch.empty((1, *self.input_shape))
+        with probe_mode(self.spatio_encoder):
+            sample_output = self.spatio_encoder(sample_input)
+        return sample_output
     
-    def get_resnet_output(self):
-        sample_input = torch.zeros((4, *self.input_shape))
-        sample_output = self.spatio_encoder(sample_input)
-        sample_output = self.resnet(sample_output)
+    def get_resnet_output(self, enc_output : torch.Tensor):
+        with probe_mode(self.resnet):
+            sample_output = self.resnet(enc_output)
         sample_output = torch.flatten(sample_output, start_dim = 1)
         return sample_output.size() 
 
     def forward(self, x : torch.Tensor):
-        x = self.spatio_encoder(x)
-        x = self.resnet(x)
+        with torch.autocast("cuda", dtype = torch.float16, enabled = self.use_amp):
+            x = self.spatio_encoder(x)
+            x = self.resnet(x)
         x = torch.flatten(x, start_dim = 1)
-        x = self.classifier(x)
+        # classifier head is kept in fp32
+        x = self.classifier(x.float())
         
         return x
 
     def summary(self)->None:
         device = next(self.parameters()).device
-        sample_input = torch.zeros((4, *self.input_shape)).to(device)
-        print(summary(self, sample_input, max_depth = None, show_parent_layers = True, show_input = True))
\ No newline at end of file
+        sample_input = torch.empty((4, *self.input_shape)).to(device)
+        with probe_mode(self):
+            print(summary(self, sample_input, max_depth = None, show_parent_layers = True, show_input = True))
\ No newline at end of file
@@ -25,12 +25,34 @@ class SubBatchNorm3d(nn.Module):
         args["num_features"] = self.num_features * self.num_splits
         self.split_bn = nn.BatchNorm3d(**args)
 
+        # split bn per num_splits, reused across multigrid long cycles instead of reallocated
+        self._split_bn_cache = {self.num_splits : self.split_bn}
+
+    def set_num_splits(self, num_splits : int)->None:
+        if num_splits == self.num_splits:
+            return
+
+        if num_splits in self._split_bn_cache:
+            bn = self._split_bn_cache[num_splits].to(self.bn.running_mean.device)
+            bn.reset_running_stats()
+        else:
+            bn = nn.BatchNorm3d(num_features = self.num_features * num_splits, affine = False).to(self.bn.running_mean.device)
+            self._split_bn_cache[num_splits] = bn
+
+        self.num_splits = num_splits
+        self.split_bn = bn
+
     def forward(self, x:torch.Tensor)->None:
+        # batch statistics are computed in the bn's own dtype : fp32 under fp16 / bf16 autocast, but fp16 after model.half()
+        dtype = x.dtype
+        x = x.to(self.bn.running_mean.dtype) if self.bn.running_mean is not None else x
+
         if self.training:
+            # reshape : a channels_last_3d input is not viewable as (n / splits, c * splits, ...)
             n,c,t,h,w = x.shape
-            x = x.view(n//self.num_splits, c * self.num_splits, t, h, w)
+            x = x.reshape(n//self.num_splits, c * self.num_splits, t, h, w)
             x = self.split_bn(x)
-            x = x.view(n,c,t,h,w)
+            x = x.reshape(n,c,t,h,w)
         else:
             x = self.bn(x)
         
@@ -38,7 +60,7 @@ class SubBatchNorm3d(nn.Module):
             x = x * self.weight.view((-1,1,1,1))
             x = x + self.bias.view((-1,1,1,1))
         
-        return x
+        return x.to(dtype)
 
     def _get_aggregated_mean_std(self, means : torch.Tensor, stds : torch.Tensor, n : int):
         mean = means.view(n, -1).sum(0) / n
@@ -263,8 +285,7 @@ class ResNet3D(nn.Module):
     def update_bn_splits_long_cycle(self, long_cycle_bn_scale):
         for m in self.modules():
             if isinstance(m, SubBatchNorm3d):
-                m.num_splits = self.base_bn_splits * long_cycle_bn_scale
-                m.split_bn = nn.BatchNorm3d(num_features = m.num_features * m.num_splits, affine = False).to(m.weight.device)
+                m.set_num_splits(self.base_bn_splits * long_cycle_bn_scale)
         
         return self.base_bn_splits * long_cycle_bn_scale
 
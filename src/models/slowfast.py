@@ -18,7 +18,10 @@ class SlowNet(ResNet3D):
     def forward(self, x)->torch.Tensor:
         x, laterals = x
         x = self.layer0(x)
+        return self.forward_layers(x, laterals)
 
+    # layer 1 to layer 4 with lateral connections, only the stem (layer 0) is independent of the fast pathway
+    def forward_layers(self, x : torch.Tensor, laterals : List[torch.Tensor])->torch.Tensor:
         #print("after layer 0 x.size : ", x.size())
         x = torch.cat([x, laterals[0]], dim = 1)
         x = self.layer1(x)
@@ -33,7 +36,7 @@ class SlowNet(ResNet3D):
         x = torch.cat([x, laterals[3]], dim = 1)
         x = self.layer4(x)
 
-        x = F.adaptive_avg_pool3d(x, 1)
+        x = x.mean(dim = (2,3,4), keepdim = True)
         x = x.view(-1, x.size(1))
 
         return x
@@ -80,7 +83,7 @@ class FastNet(ResNet3D):
 
         x = self.layer4(x)
 
-        x = F.adaptive_avg_pool3d(x, 1)
+        x = x.mean(dim = (2,3,4), keepdim = True)
         x = x.view(-1, x.size(1))
 
         return x, laterals
@@ -114,13 +117,22 @@ class SlowFastEncoder(nn.Module):
 
         self.slownet = resnet50_s(block = block, layers = layers, alpha = alpha, in_channels = self.in_channels, slow = 1, base_bn_splits = None)
         self.fastnet = resnet50_f(block = block, layers = layers, alpha = alpha, in_channels = self.in_channels, slow = 0, base_bn_splits = None)
+        self.build_temporal_index(self.seq_len)
+
+    def build_temporal_index(self, seq_len : int, device : Optional[torch.device] = None)->None:
+        # frame indices of each pathway, rebuilt only when the clip length or the input device changes
+        tau_slow = self.tau_fast * self.alpha
+        self.index_seq_len = seq_len
+        self.register_buffer("slow_index", torch.arange(0, seq_len, tau_slow, device = device), persistent = False)
+        self.register_buffer("fast_index", torch.arange(0, seq_len, self.tau_fast, device = device), persistent = False)
 
     def split_slow_fast(self, x : torch.Tensor)->Tuple[torch.Tensor, torch.Tensor]:
-        tau_fast = self.tau_fast
-        tau_slow = tau_fast * self.alpha
+        if x.size(2) != self.index_seq_len or self.slow_index.device != x.device:
+            self.build_temporal_index(x.size(2), x.device)
 
-        x_slow = x[:,:,::tau_slow, :, :]
-        x_fast = x[:,:,::tau_fast, :, :]
+        # gather into contiguous tensors so the first conv of each pathway does not read strided views
+        x_slow = x.index_select(2, self.slow_index)
+        x_fast = x if self.tau_fast == 1 else x.index_select(2, self.fast_index)
 
         return (x_slow, x_fast)
 
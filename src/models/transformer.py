@@ -22,8 +22,9 @@ class PositionalEncoding(nn.Module):
         self.register_buffer('pe', pe)
 
     def forward(self, doy:torch.Tensor):
-        doy = doy.type(dtype = torch.LongTensor)
-        return self.pe[doy.view(-1), :]
+        # index on the device of doy, .type(torch.LongTensor) would copy it to the host
+        doy = doy.long()
+        return self.pe[doy.reshape(-1), :]
 
 class GELU(nn.Module):
     def forward(self, x):
@@ -134,9 +135,7 @@ class BertEmbedding(nn.Module):
 
         obs_embed = self.input(input_sequence) # batch_size, seq_length, embedding_dim
         x = obs_embed.repeat(1,1,2) # batch_size, seq_length, embedding_dim * 2
-        
-        for i in range(batch_size):
-            x[i, :, self.embed_size : ] = self.position(doy_sequence[i, :]) 
+        x[:, :, self.embed_size : ] = self.position(doy_sequence).view(batch_size, seq_length, -1)
 
         return self.dropout(x)
 
@@ -9,6 +9,14 @@ from src.utils.mixup import mixup_criterion, video_mixup_data
 from tqdm import tqdm
 from sklearn.metrics import confusion_matrix, classification_report, f1_score
 
+def get_grad_scaler(model : torch.nn.Module)->Optional[torch.cuda.amp.GradScaler]:
+    # loss scaling for fp16 autocast training (model.use_amp), bf16 keeps the fp32 exponent range and needs none
+    use_fp16 = getattr(model, "use_amp", False) and getattr(model, "amp_dtype", torch.float16) == torch.float16
+    if not use_fp16:
+        return None
+    # torch.amp.GradScaler from torch 2.3, torch.cuda.amp.GradScaler is deprecated there
+    return torch.amp.GradScaler("cuda") if hasattr(torch.amp, "GradScaler") else torch.cuda.amp.GradScaler()
+
 def train_per_epoch(
     train_loader : torch.utils.data.DataLoader, 
     model : torch.nn.Module,
@@ -17,7 +25,8 @@ def train_per_epoch(
     loss_fn : torch.nn.Module,
     device : str = "cpu",
     use_video_mixup : bool = False,
-    max_norm_grad : Optional[float] = None
+    max_norm_grad : Optional[float] = None,
+    scaler : Optional[torch.cuda.amp.GradScaler] = None
     ):
 
     model.train()
@@ -47,13 +56,22 @@ def train_per_epoch(
         else:
             loss = loss_fn(output, target)
 
-        loss.backward()
+        if scaler is not None:
+            scaler.scale(loss).backward()
+        else:
+            loss.backward()
 
         # use gradient clipping
         if max_norm_grad:
+            if scaler is not None:
+                scaler.unscale_(optimizer)
             torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm_grad)
 
-        optimizer.step()
+        if scaler is not None:
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            optimizer.step()
 
         train_loss += loss.item()
 
@@ -152,6 +170,8 @@ def train(
     if loss_fn is None:
         loss_fn = torch.nn.CrossEntropyLoss(reduction = 'mean')
 
+    scaler = get_grad_scaler(model)
+
     for epoch in tqdm(range(num_epoch), desc = "training process"):
 
         train_loss, train_acc, train_f1 = train_per_epoch(
@@ -162,7 +182,8 @@ def train(
             loss_fn,
             device,
             use_video_mixup_algorithm,
-            max_norm_grad
+            max_norm_grad,
+            scaler = scaler
         )
 
         valid_loss, valid_acc, valid_f1 = valid_per_epoch(
@@ -252,6 +273,8 @@ def train_LDAM_process(
     best_epoch = 0
     best_loss = torch.inf
 
+    scaler = get_grad_scaler(model)
+
     for epoch in tqdm(range(num_epoch), desc = "training process"):
         idx = epoch // int(num_epoch / 4)
         betas = [0, 0.25, 0.75, 0.9]
@@ -271,7 +294,8 @@ def train_LDAM_process(
             None,
             loss_fn,
             device,
-            max_norm_grad
+            max_norm_grad,
+            scaler = scaler
         )
 
         valid_loss, valid_acc, valid_f1 = valid_per_epoch(
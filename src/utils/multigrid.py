@@ -7,6 +7,7 @@ import torch
 from tqdm import tqdm
 from torch.utils.data import sampler
 from src.dataloader import VideoDataset
+from src.train import get_grad_scaler
 from src.utils.sampler import ImbalancedDatasetSampler
 from src.transforms.spatial_transforms import Compose, MultiScaleRandomCropMultigrid, CenterCropScaled
 from src.transforms.temporal_transforms import TemporalRandomCrop
@@ -428,6 +429,7 @@ def train_multigrid(
     best_loss = torch.inf
 
     model.to(device)
+    scaler = get_grad_scaler(model)
 
     for epoch in tqdm(range(num_epoch), desc = "training process"):
         # train process
@@ -457,8 +459,13 @@ def train_multigrid(
             output = model(data)
 
             loss = loss_fn(output, target)
-            loss.backward()
-            optimizer.step()
+            if scaler is not None:
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                loss.backward()
+                optimizer.step()
 
             train_loss += loss.item()
             pred = torch.nn.functional.softmax(output, dim = 1).max(1, keepdim = True)[1]
@@ -7,7 +7,7 @@ import argparse
 import matplotlib.pyplot as plt
 from src.dataloader import VideoDataset
 from torch.utils.data import DataLoader
-from src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder
+from src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder, set_backend_flags
 from src.utils.sampler import ImbalancedDatasetSampler
 from src.models.transformer import SBERT
 from src.train import train
@@ -44,6 +44,9 @@ print("torch device num : ", torch.cuda.device_count())
 torch.cuda.init()
 torch.cuda.empty_cache()
 
+# backend setup for the compiled classifier forward
+set_backend_flags()
+
 # device allocation
 if(torch.cuda.device_count() >= 1):
     device = "cuda:" + str(args["gpu_num"])
@@ -6,7 +6,7 @@ import os
 import matplotlib.pyplot as plt
 from src.dataloader import VideoDataset
 from torch.utils.data import DataLoader
-from src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder
+from src.models.model import SBERTDisruptionClassifier, SITSBertSpatialEncoder, set_backend_flags
 from src.utils.sampler import ImbalancedDatasetSampler
 from src.models.transformer import SBERT
 from src.train import train_
@@ -105,6 +105,9 @@ print("torch device num : ", torch.cuda.device_count())
 torch.cuda.init()
 torch.cuda.empty_cache()
 
+# backend setup for the compiled classifier forward
+set_backend_flags()
+
 if __name__ == "__main__":
 
     args = parsing()
@@ -1,4 +1,4 @@
-from src.models.model import SlowFastDisruptionClassifier
+from src.models.model import SlowFastDisruptionClassifier, set_backend_flags
 from src.models.resnet import Bottleneck3D
 from src.utils.multigrid import train_multigrid
 import torch
@@ -12,6 +12,9 @@ print("torch device num : ", torch.cuda.device_count())
 torch.cuda.init()
 torch.cuda.empty_cache()
 
+# backend setup for the compiled classifier forward
+set_backend_flags()
+
 # device allocation
 if(torch.cuda.device_count() >= 1):
     device = "cuda:0" 
@@ -32,7 +35,9 @@ if __name__ == "__main__":
         p = p,
         mlp_hidden = hidden,
         num_classes  = 2,
-        base_bn_splits=8
+        base_bn_splits=8,
+        # multigrid cycles change the input shape and swap split_bn modules : a static compiled forward would recompile each time
+        compile = False
     )
 
     train_multigrid(